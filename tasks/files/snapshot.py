@@ -9,15 +9,33 @@ import re
 import stat
 import subprocess
 import sys
-from os.path import join as path_join
+import threading
+from collections import defaultdict
+
+try:
+    from shutil import which
+except ImportError:
+    # python 2
+    from distutils.spawn import find_executable as which
+
+try:
+    # pysimdjson is optional, but parses the lvm reports much faster
+    from simdjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
 
 logger = logging.getLogger("snapshot-role")
 
 LVM_NOTFOUND_RC = 5
 MAX_LVM_NAME = 127
 CHUNK_SIZE = 65536
+# maximum number of VGs worked on in parallel
+MAX_VG_THREADS = 8
 DEV_PREFIX = "/dev"
 
+# compiled --vg-include pattern, set from the command line
+VG_INCLUDE = None
+
 # Minimum LVM snapshot size (512MiB)
 LVM_MIN_SNAPSHOT_SIZE = 512 * 1024**2
 
@@ -43,7 +61,9 @@ class VGSpaceState:
     vg_extent_size = 0  # The size of the physical extents in the volume group
     vg_size = 0  # The size of the volume group
     vg_free = 0  # Size of the free space remaining in the volume group
-    lvs = dict()
+
+    def __init__(self):
+        self.lvs = dict()  # lv name to LVSpaceState, per VG
 
 
 class SnapshotCommand:
@@ -101,25 +121,24 @@ class SnapshotStatus:
     ERROR_UMOUNT_NOT_MOUNTED = 38
 
 
+VALID_COMMANDS = frozenset(
+    (
+        SnapshotCommand.SNAPSHOT,
+        SnapshotCommand.CHECK,
+        SnapshotCommand.REMOVE,
+        SnapshotCommand.REVERT,
+        SnapshotCommand.EXTEND,
+        SnapshotCommand.LIST,
+        SnapshotCommand.MOUNT,
+        SnapshotCommand.UMOUNT,
+    )
+)
+
+
 def get_command_const(command):
-    if command == SnapshotCommand.SNAPSHOT:
-        return SnapshotCommand.SNAPSHOT
-    elif command == SnapshotCommand.CHECK:
-        return SnapshotCommand.CHECK
-    elif command == SnapshotCommand.REMOVE:
-        return SnapshotCommand.REMOVE
-    elif command == SnapshotCommand.REVERT:
-        return SnapshotCommand.REVERT
-    elif command == SnapshotCommand.EXTEND:
-        return SnapshotCommand.EXTEND
-    elif command == SnapshotCommand.LIST:
-        return SnapshotCommand.LIST
-    elif command == SnapshotCommand.MOUNT:
-        return SnapshotCommand.MOUNT
-    elif command == SnapshotCommand.UMOUNT:
-        return SnapshotCommand.UMOUNT
-    else:
-        return SnapshotCommand.INVALID
+    if command in VALID_COMMANDS:
+        return command
+    return SnapshotCommand.INVALID
 
 
 def makedirs(path):
@@ -292,8 +311,24 @@ def set_up_logging(log_dir="/tmp", log_prefix="snapshot_role"):
     # logger.addHandler(stdout_handler)
 
 
-def run_command(argv, stdin=None):
+# full paths of the commands run so far, so that PATH is only searched
+# once per command
+command_paths = dict()
+
+
+def find_command(command):
+    if command not in command_paths:
+        # leave the name alone if not found, running it will report the error
+        command_paths[command] = which(command) or command
+    return command_paths[command]
+
+
+def run_command(argv, stdin=None, input_text=None):
+    argv = [find_command(argv[0])] + argv[1:]
     logger.info("Running... %s", " ".join(argv))
+    if input_text is not None:
+        stdin = subprocess.PIPE
+        input_text = input_text.encode("utf-8")
     try:
         proc = subprocess.Popen(
             argv,
@@ -303,7 +338,7 @@ def run_command(argv, stdin=None):
             close_fds=True,
         )
 
-        out, err = proc.communicate()
+        out, err = proc.communicate(input_text)
         if err:
             logger.info(err.decode().strip())
             out = err.decode("utf-8")
@@ -320,6 +355,20 @@ def run_command(argv, stdin=None):
     return (proc.returncode, out)
 
 
+def run_lvm_shell(commands):
+    """Run the lvm commands, each an argv list such as ["lvcreate", ...],
+    in a single lvm shell to save the start up cost of an lvm process per
+    command.  The shell doesn't report the status of each command, so the
+    caller must check the results in the lvm metadata afterwards.  Callers
+    queue the commands for the whole set first and only run the shell if
+    every volume queued without error; on an error nothing is run, so the
+    set is left as it was."""
+    shell_input = "".join(" ".join(command) + "\n" for command in commands)
+    rc, output = run_command(["lvm"], input_text=shell_input + "exit\n")
+    lvm_cache.invalidate()
+    return rc, output
+
+
 def check_positive(value):
     try:
         value = int(value)
@@ -364,10 +413,10 @@ def lvm_full_report_json():
     rc, output = run_command(report_command)
 
     if rc:
-        logger.info("'fullreport' exited with code : {rc}", rc=rc)
+        logger.info("'fullreport' exited with code : %d", rc)
         raise LvmBug("'fullreport' exited with code : %d" % rc)
     try:
-        lvm_json = json.loads(output)
+        lvm_json = json_loads(output)
     except ValueError as error:
         logger.info(error)
         raise LvmBug("'fullreport' decode failed : %s" % error.args[0])
@@ -375,44 +424,140 @@ def lvm_full_report_json():
     return lvm_json
 
 
-def lvm_get_fs_mount_points(block_path):
-    find_mnt_command = [
-        "findmnt",
-        block_path,
-        "-P",
-    ]
-    mount_list = list()
+class LvmCache:
+    """
+    Cache of the 'lvm fullreport' output, so that the vg/lv queries made
+    while processing a set don't each have to run an lvm command.  Anything
+    that changes the lvm metadata must call invalidate() afterwards.
+    """
 
-    rc, output = run_command(find_mnt_command)
-    if rc:
-        return None
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.report = None
+        self.vgs = dict()
+
+    def _load(self):
+        # must be called with self.lock held
+        if self.report is None:
+            report = lvm_full_report_json()
+            vgs = dict()
+            for list_item in report["report"]:
+                vg = list_item.get("vg", [{}])[0]
+                if vg and vg["vg_name"]:
+                    vgs[vg["vg_name"]] = {lv["lv_name"]: lv for lv in list_item["lv"]}
+            self.vgs = vgs
+            self.report = report
+
+    def load(self):
+        with self.lock:
+            self._load()
+            return self.report
+
+    def get_vgs(self):
+        """Return a dict of vg name to a dict of lv name to lv."""
+        with self.lock:
+            self._load()
+            return self.vgs
+
+    def get_lv(self, vg_name, lv_name):
+        return self.get_vgs().get(vg_name, {}).get(lv_name)
+
+    def invalidate(self):
+        with self.lock:
+            self.report = None
+            self.vgs = dict()
+
+
+lvm_cache = LvmCache()
+
+
+def _unescape_mountinfo(field):
+    # the kernel escapes space, tab, newline and backslash as octal
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), field)
+
+
+def _load_mountinfo():
+    """Parse /proc/self/mountinfo into a dict.  Keys are the mount targets
+    and the canonical paths of the mount sources, values are lists of the
+    mounts using them.  Each mount is a dict with the same keys as reported
+    by 'findmnt -P'."""
+    mountinfo_index = dict()
+    with open("/proc/self/mountinfo") as mi:
+        lines = mi.read().splitlines()
+
+    for line in lines:
+        fields = line.split()
+        # optional fields are terminated by a single hyphen
+        sep = fields.index("-", 6)
+        target = _unescape_mountinfo(fields[4])
+        source = _unescape_mountinfo(fields[sep + 2])
+        options = fields[5].split(",")
+        options.extend(opt for opt in fields[sep + 3].split(",") if opt not in options)
+        mount_point = {
+            "TARGET": target,
+            "SOURCE": source,
+            "FSTYPE": fields[sep + 1],
+            "OPTIONS": ",".join(options),
+        }
+
+        mountinfo_index.setdefault(target, []).append(mount_point)
+        if source.startswith("/"):
+            source_path = os.path.realpath(source)
+            if source_path != target:
+                mountinfo_index.setdefault(source_path, []).append(mount_point)
+
+    return mountinfo_index
+
+
+class MountInfoCache:
+    """
+    Cache of the parsed /proc/self/mountinfo.  Must be invalidated after
+    anything is mounted or unmounted.
+    """
+
+    def __init__(self):
+        self.index = None
+
+    def load(self):
+        if self.index is None:
+            self.index = _load_mountinfo()
+        return self.index
 
-    output = output.replace('"', "")
+    def invalidate(self):
+        self.index = None
 
-    for line in output.split("\n"):
-        if len(line):
-            mount_list.append(dict(arg.split("=", 1) for arg in line.split(" ") if arg))
 
-    return mount_list
+mountinfo_cache = MountInfoCache()
 
 
-def vgs_lvs_iterator(vg_name, lv_name, omit_empty_lvs=False):
+def lvm_get_fs_mount_points(block_path):
+    """Return the list of mounts for block_path, which is either a block
+    device or a mount point, or None if it is not mounted."""
+    if not block_path:
+        # realpath("") is the current directory, not a device
+        return None
+    return mountinfo_cache.load().get(os.path.realpath(block_path))
+
+
+def vgs_lvs_iterator(vg_name, lv_name, omit_empty_lvs=False, vg_names=None):
     """Return an iterator which returns tuples.
     The first element in the tuple is the vg object matching given vg_name,
     or all vgs if vg_name is None.  The second element is a list of
     corresponding lv items where the lv name matches the given
     lv_name, or all lvs if lv_name is None.  By default the lv list
     will be returned even if empty.  Use omit_empty_lvs if you want
-    only the vgs that have lvs."""
-    lvm_json = lvm_full_report_json()
+    only the vgs that have lvs.  If vg_names is given, only the vgs
+    named in it are returned."""
+    vg_include = VG_INCLUDE
+    lvm_json = lvm_cache.load()
     for list_item in lvm_json["report"]:
         vg = list_item.get("vg", [{}])[0]
-        # pylint: disable-msg=E0601
         if (
             vg
             and vg["vg_name"]
             and (not vg_name or vg_name == vg["vg_name"])
-            and (not VG_INCLUDE or VG_INCLUDE.search(vg["vg_name"]))
+            and (vg_names is None or vg["vg_name"] in vg_names)
+            and (not vg_include or vg_include.search(vg["vg_name"]))
         ):
             lvs = [
                 lv
@@ -427,20 +572,24 @@ def vgs_lvs_dict(vg_name, lv_name):
     """Return a dict using vgs_lvs_iterator.  Key is
     vg name, value is list of lvs corresponding to vg.
     The returned dict will not have vgs that have no lvs."""
-    return dict(
-        [(vg["vg_name"], lvs) for vg, lvs in vgs_lvs_iterator(vg_name, lv_name, True)]
-    )
+    return {vg["vg_name"]: lvs for vg, lvs in vgs_lvs_iterator(vg_name, lv_name, True)}
 
 
 def lvm_list_json(vg_name, lv_name):
     vg_dict = vgs_lvs_dict(vg_name, lv_name)
-    fs_dict = dict()
+    mountinfo_index = mountinfo_cache.load()
+    # thin pools and internal lvs have no lv_path, and realpath("") would
+    # be the current directory
+    fs_dict = {
+        lv_item["lv_path"]: (
+            mountinfo_index.get(os.path.realpath(lv_item["lv_path"]))
+            if lv_item["lv_path"]
+            else None
+        )
+        for lv_list in vg_dict.values()
+        for lv_item in lv_list
+    }
     top_level = dict()
-    for lv_list in vg_dict.values():
-        for lv_item in lv_list:
-            block_path = lv_item["lv_path"]
-            fs_mount_points = lvm_get_fs_mount_points(block_path)
-            fs_dict[block_path] = fs_mount_points
 
     top_level["volumes"] = vg_dict
     top_level["mounts"] = fs_dict
@@ -448,12 +597,12 @@ def lvm_list_json(vg_name, lv_name):
 
 
 def get_snapshot_name(lv_name, suffix):
-    if suffix:
-        suffix_str = suffix
-    else:
-        suffix_str = ""
+    return lv_name + "_" + (suffix or "")
+
 
-    return lv_name + "_" + suffix_str
+def get_lv_dev_path(vg_name, lv_name):
+    # vg and lv names never contain "/", so no os.path.join needed
+    return "%s/%s/%s" % (DEV_PREFIX, vg_name, lv_name)
 
 
 def lvm_lv_exists(vg_name, lv_name):
@@ -462,65 +611,57 @@ def lvm_lv_exists(vg_name, lv_name):
 
     if not vg_name:
         return SnapshotStatus.SNAPSHOT_OK, vg_exists, lv_exists
-    # check for VG
-    lvs_command = ["lvs", vg_name]
 
-    rc, _output = run_command(lvs_command)
-    if rc == 0:
-        vg_exists = True
+    # check for VG
+    vgs = lvm_cache.get_vgs()
+    vg_exists = vg_name in vgs
 
     if not lv_name:
         return SnapshotStatus.SNAPSHOT_OK, vg_exists, lv_exists
 
-    lvs_command = ["lvs", vg_name + "/" + lv_name]
-    rc, _output = run_command(lvs_command)
-    if rc == 0:
-        lv_exists = True
+    lv_exists = vg_exists and lv_name in vgs[vg_name]
 
     return SnapshotStatus.SNAPSHOT_OK, vg_exists, lv_exists
 
 
-def lvm_is_owned(lv_name, suffix):
-    if suffix:
-        suffix_str = suffix
-    else:
-        suffix_str = ""
+def lvm_lv_present(vg_name, lv_name):
+    """Return True if vg_name/lv_name exists.  The lookup is served from
+    lvm_cache, so unlike lvm_lv_exists there is no rc to check."""
+    return lvm_cache.get_lv(vg_name, lv_name) is not None
 
-    if not lv_name.endswith(suffix_str):
-        return False
 
-    return True
+def lvm_is_owned(lv_name, suffix):
+    return lv_name.endswith(suffix or "")
 
 
-def lvm_is_inuse(vg_name, lv_name):
-    lvs_command = ["lvs", "--reportformat", "json", vg_name + "/" + lv_name]
+def lvm_lookup(vg_name, lv_name):
+    """Return a tuple (exists, is_snapshot, lv_attr, lv_size) for
+    vg_name/lv_name.  lv_attr and lv_size are None if the lv does not
+    exist."""
+    lv = lvm_cache.get_lv(vg_name, lv_name)
 
-    rc, output = run_command(lvs_command)
+    if lv is None:
+        return False, False, None, None
 
-    if rc == LVM_NOTFOUND_RC:
-        return SnapshotStatus.SNAPSHOT_OK, False
+    lv_attr = lv["lv_attr"]
 
-    if rc:
-        return SnapshotStatus.ERROR_LVS_FAILED, None
+    if len(lv_attr) == 0:
+        raise LvmBug("'fullreport' zero length attr : '%s/%s'" % (vg_name, lv_name))
 
-    try:
-        lvs_json = json.loads(output)
-    except ValueError as error:
-        logger.info(error)
-        message = "lvm_is_inuse: json decode failed : %s" % error.args[0]
-        return SnapshotStatus.ERROR_JSON_PARSER_ERROR, message
+    return True, lv_attr[0] == "s", lv_attr, int(lv["lv_size"])
 
-    lv_list = lvs_json["report"]
 
-    if len(lv_list) > 1 or len(lv_list[0]["lv"]) > 1:
-        raise LvmBug("'lvs' returned more than 1 lv '%d'" % rc)
+def lvm_get_attr(vg_name, lv_name):
+    """Return the lv_attr string for vg_name/lv_name, or None if the
+    lv does not exist."""
+    return lvm_lookup(vg_name, lv_name)[2]
 
-    lv = lv_list[0]["lv"][0]
 
-    lv_attr = lv["lv_attr"]
+def lvm_is_inuse(vg_name, lv_name):
+    lv_attr = lvm_get_attr(vg_name, lv_name)
 
-    if len(lv_attr) == 0:
-        raise LvmBug("'lvs' zero length attr : '%d'" % rc)
+    if lv_attr is None:
+        return SnapshotStatus.SNAPSHOT_OK, False
 
     # check if the device is open
     if lv_attr[5] == "o":
@@ -530,35 +671,11 @@ def lvm_is_inuse(vg_name, lv_name):
 
 
 def lvm_is_snapshot(vg_name, snapshot_name):
-    lvs_command = ["lvs", "--reportformat", "json", vg_name + "/" + snapshot_name]
-
-    rc, output = run_command(lvs_command)
+    lv_attr = lvm_get_attr(vg_name, snapshot_name)
 
-    if rc == LVM_NOTFOUND_RC:
+    if lv_attr is None:
         return SnapshotStatus.SNAPSHOT_OK, False
 
-    if rc:
-        return SnapshotStatus.ERROR_LVS_FAILED, None
-
-    try:
-        lvs_json = json.loads(output)
-    except ValueError as error:
-        logger.info(error)
-        message = "lvm_is_snapshot: json decode failed : %s" % error.args[0]
-        return SnapshotStatus.ERROR_JSON_PARSER_ERROR, message
-
-    lv_list = lvs_json["report"]
-
-    if len(lv_list) > 1 or len(lv_list[0]["lv"]) > 1:
-        raise LvmBug("'lvs' returned more than 1 lv '%d'" % rc)
-
-    lv = lv_list[0]["lv"][0]
-
-    lv_attr = lv["lv_attr"]
-
-    if len(lv_attr) == 0:
-        raise LvmBug("'lvs' zero length attr : '%d'" % rc)
-
     if lv_attr[0] == "s":
         return SnapshotStatus.SNAPSHOT_OK, True
     else:
@@ -583,6 +700,7 @@ def lvm_snapshot_remove(vg_name, snapshot_name, check_mode):
         return rc, "Would run command " + " ".join(remove_command)
 
     rc, output = run_command(remove_command)
+    lvm_cache.invalidate()
 
     if rc:
         return SnapshotStatus.ERROR_REMOVE_FAILED, output
@@ -590,29 +708,44 @@ def lvm_snapshot_remove(vg_name, snapshot_name, check_mode):
     return SnapshotStatus.SNAPSHOT_OK, ""
 
 
-def revert_lv(vg_name, snapshot_name, check_mode):
-    rc, _vg_exists, lv_exists = lvm_lv_exists(vg_name, snapshot_name)
-    if rc != SnapshotStatus.SNAPSHOT_OK:
-        raise LvmBug("'lvs' failed '%d'" % rc)
+def revert_lv(vg_name, snapshot_name, check_mode, batch=None):
+    lv_exists, is_snapshot, lv_attr, _lv_size = lvm_lookup(vg_name, snapshot_name)
+    snapshot_spec = vg_name + "/" + snapshot_name
 
-    if lv_exists:
-        if not lvm_is_snapshot(vg_name, snapshot_name):
-            return (
-                SnapshotStatus.ERROR_REVERT_FAILED,
-                "LV with name: " + vg_name + "/" + snapshot_name + " is not a snapshot",
-            )
-    else:
+    if not lv_exists:
         return (
             SnapshotStatus.ERROR_LV_NOTFOUND,
-            "snapshot not found with name: " + vg_name + "/" + snapshot_name,
+            "snapshot not found with name: " + snapshot_spec,
+        )
+
+    if lv_attr[0] == "S":
+        # the merge was deferred because the origin is open, and will
+        # happen on its next activation
+        return (
+            SnapshotStatus.ERROR_ALREADY_DONE,
+            "snapshot merge already pending: " + snapshot_spec,
+        )
+
+    if not is_snapshot:
+        return (
+            SnapshotStatus.ERROR_REVERT_FAILED,
+            "LV with name: " + snapshot_spec + " is not a snapshot",
         )
 
-    revert_command = ["lvconvert", "--merge", vg_name + "/" + snapshot_name]
+    revert_command = ["lvconvert", "--merge", snapshot_spec]
 
     if check_mode:
-        return rc, "Would run command " + " ".join(revert_command)
+        return (
+            SnapshotStatus.SNAPSHOT_OK,
+            "Would run command " + " ".join(revert_command),
+        )
+
+    if batch is not None:
+        batch.append(revert_command)
+        return SnapshotStatus.SNAPSHOT_OK, ""
 
     rc, output = run_command(revert_command)
+    lvm_cache.invalidate()
 
     if rc:
         return SnapshotStatus.ERROR_REVERT_FAILED, output
@@ -620,30 +753,41 @@ def revert_lv(vg_name, snapshot_name, check_mode):
     return SnapshotStatus.SNAPSHOT_OK, output
 
 
-def extend_lv_snapshot(vg_name, lv_name, suffix, percent_space_required, check_mode):
+def extend_lv_snapshot(
+    vg_name,
+    lv_name,
+    suffix,
+    percent_space_required,
+    check_mode,
+    current_space_dict=None,
+    batch=None,
+):
     snapshot_name = get_snapshot_name(lv_name, suffix)
 
-    rc, _vg_exists, lv_exists = lvm_lv_exists(vg_name, snapshot_name)
+    lv_exists, is_snapshot, _lv_attr, current_size = lvm_lookup(vg_name, snapshot_name)
+    snapshot_spec = vg_name + "/" + snapshot_name
 
     changed = False
-    if lv_exists:
-        if not lvm_is_snapshot(vg_name, snapshot_name):
-            return (
-                SnapshotStatus.ERROR_EXTEND_NOT_SNAPSHOT,
-                "LV with name: " + vg_name + "/" + snapshot_name + " is not a snapshot",
-                changed,
-            )
-    else:
+    if not lv_exists:
         return (
             SnapshotStatus.ERROR_EXTEND_NOT_FOUND,
-            "snapshot not found with name: " + vg_name + "/" + snapshot_name,
+            "snapshot not found with name: " + snapshot_spec,
             changed,
         )
-    rc, _message, current_space_dict = get_current_space_state()
-    if rc != SnapshotStatus.SNAPSHOT_OK:
-        return rc, "extend_lv get_space_state failure", changed
 
-    current_size = current_space_dict[vg_name].lvs[snapshot_name].lv_size
+    if not is_snapshot:
+        return (
+            SnapshotStatus.ERROR_EXTEND_NOT_SNAPSHOT,
+            "LV with name: " + snapshot_spec + " is not a snapshot",
+            changed,
+        )
+
+    rc = SnapshotStatus.SNAPSHOT_OK
+    if current_space_dict is None:
+        rc, _message, current_space_dict = get_current_space_state([vg_name])
+        if rc != SnapshotStatus.SNAPSHOT_OK:
+            return rc, "extend_lv get_space_state failure", changed
+
     required_size = get_space_needed(
         vg_name, lv_name, percent_space_required, current_space_dict
     )
@@ -656,13 +800,18 @@ def extend_lv_snapshot(vg_name, lv_name, suffix, percent_space_required, check_m
         "lvextend",
         "-L",
         str(required_size) + "B",
-        vg_name + "/" + snapshot_name,
+        snapshot_spec,
     ]
 
     if check_mode:
         return rc, "Would run command " + " ".join(extend_command), changed
 
+    if batch is not None:
+        batch.append(extend_command)
+        return SnapshotStatus.SNAPSHOT_OK, "", True  # changed
+
     rc, output = run_command(extend_command)
+    lvm_cache.invalidate()
 
     if rc != SnapshotStatus.SNAPSHOT_OK:
         return SnapshotStatus.ERROR_EXTEND_FAILED, output, changed
@@ -670,10 +819,13 @@ def extend_lv_snapshot(vg_name, lv_name, suffix, percent_space_required, check_m
     return SnapshotStatus.SNAPSHOT_OK, output, True  # changed
 
 
-def extend_check_size(vg_name, lv_name, snapshot_name, percent_space_required):
-    rc, _message, current_space_dict = get_current_space_state()
-    if rc != SnapshotStatus.SNAPSHOT_OK:
-        return rc, "extend_lv get_space_state failure", None
+def extend_check_size(
+    vg_name, lv_name, snapshot_name, percent_space_required, current_space_dict=None
+):
+    if current_space_dict is None:
+        rc, _message, current_space_dict = get_current_space_state([vg_name])
+        if rc != SnapshotStatus.SNAPSHOT_OK:
+            return rc, "extend_lv get_space_state failure", None
 
     current_size = current_space_dict[vg_name].lvs[snapshot_name].lv_size
     required_size = get_space_needed(
@@ -693,26 +845,110 @@ def extend_check_size(vg_name, lv_name, snapshot_name, percent_space_required):
     return SnapshotStatus.SNAPSHOT_OK, False, "current size too small"
 
 
-def extend_snapshot_set(snapset_json, check_mode):
+def run_per_vg(volume_list, volume_func):
+    """Call volume_func for each item in volume_list.  volume_func returns
+    a (rc, message, changed) tuple.  The items of one VG are handled in
+    order by a single thread, since lvm serializes the commands on a VG
+    with the VG lock anyway, and different VGs are handled in parallel.
+    Once an item fails, the rest of its VG is skipped and no VG that
+    hasn't started yet is started, but VGs already being worked on run
+    to completion.  Returns (rc, message, changed) for the whole list,
+    where a failure is reported for the first failed item in
+    volume_list."""
+    results = [None] * len(volume_list)
+    vg_items = dict()
+    for index, list_item in enumerate(volume_list):
+        vg_items.setdefault(list_item["vg"], []).append(index)
+
+    pending = list(vg_items.values())
+    errors = []
+    failed = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not pending or errors or failed:
+                    return
+                indexes = pending.pop(0)
+            try:
+                for index in indexes:
+                    results[index] = volume_func(volume_list[index])
+                    if results[index][0] != SnapshotStatus.SNAPSHOT_OK:
+                        with lock:
+                            failed.append(index)
+                        break
+            except Exception as exc:
+                # re-raised in the calling thread
+                with lock:
+                    errors.append(exc)
+
+    workers = [
+        threading.Thread(target=worker)
+        for _i in range(min(len(pending), MAX_VG_THREADS))
+    ]
+    if len(workers) > 1:
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+    else:
+        worker()
+
+    if errors:
+        raise errors[0]
+
+    changed = any(result[2] for result in results if result)
+    for result in results:
+        if result and result[0] != SnapshotStatus.SNAPSHOT_OK:
+            return result[0], result[1], changed
+
+    return SnapshotStatus.SNAPSHOT_OK, "", changed
+
+
+def extend_snapshot_set(snapset_json, check_mode, use_lvm_shell=False):
     snapset_name = snapset_json["name"]
     volume_list = snapset_json["volumes"]
     logger.info("extend snapsset : %s", snapset_name)
 
     changed = False
-    for list_item in volume_list:
-        vg = list_item["vg"]
-        lv = list_item["lv"]
-        percent_space_required = list_item["percent_space_required"]
+    rc, _message, current_space_dict = get_current_space_state(
+        set(list_item["vg"] for list_item in volume_list)
+    )
+    if rc != SnapshotStatus.SNAPSHOT_OK:
+        return rc, "extend_lv get_space_state failure", changed
 
-        rc, message, cmd_changed = extend_lv_snapshot(
-            vg, lv, snapset_name, percent_space_required, check_mode
+    batch = [] if use_lvm_shell and len(volume_list) > 1 else None
+
+    def extend_volume(list_item):
+        return extend_lv_snapshot(
+            list_item["vg"],
+            list_item["lv"],
+            snapset_name,
+            list_item["percent_space_required"],
+            check_mode,
+            current_space_dict,
+            batch,
         )
 
+    if batch is None:
+        return run_per_vg(volume_list, extend_volume)
+
+    for list_item in volume_list:
+        rc, message, cmd_changed = extend_volume(list_item)
+
+        if rc != SnapshotStatus.SNAPSHOT_OK:
+            # nothing queued has run yet, so the set is unchanged
+            return rc, message, False
+
         if cmd_changed:
             changed = True
 
+    if batch:
+        _rc, output = run_lvm_shell(batch)
+        rc, message = extend_verify_snapshot_set(snapset_json)
         if rc != SnapshotStatus.SNAPSHOT_OK:
-            return rc, message, changed
+            return SnapshotStatus.ERROR_EXTEND_FAILED, message + ": " + output, changed
 
     return SnapshotStatus.SNAPSHOT_OK, "", changed
 
@@ -723,31 +959,30 @@ def extend_verify_snapshot_set(snapset_json):
 
     logger.info("extend verify snapsset : %s", snapset_name)
 
+    rc, _message, current_space_dict = get_current_space_state(
+        set(list_item["vg"] for list_item in volume_list)
+    )
+    if rc != SnapshotStatus.SNAPSHOT_OK:
+        return rc, "extend_lv get_space_state failure"
+
     for list_item in volume_list:
         vg = list_item["vg"]
         lv = list_item["lv"]
         percent_space_required = list_item["percent_space_required"]
 
         snapshot_name = get_snapshot_name(lv, snapset_name)
+        snapshot_spec = vg + "/" + snapshot_name
 
-        rc, _vg_exists, lv_exists = lvm_lv_exists(vg, snapshot_name)
-        if rc != SnapshotStatus.SNAPSHOT_OK:
-            return (
-                rc,
-                "failure to get status for: " + vg + "/" + snapshot_name,
-            )
+        lv_exists = lvm_lv_present(vg, snapshot_name)
 
         if not lv_exists:
             return (
                 SnapshotStatus.ERROR_EXTEND_VERIFY_FAILED,
-                "extend verify snapshot not found for source LV: "
-                + vg
-                + "/"
-                + snapshot_name,
+                "extend verify snapshot not found for source LV: " + snapshot_spec,
             )
 
         rc, size_ok, message = extend_check_size(
-            vg, lv, snapshot_name, percent_space_required
+            vg, lv, snapshot_name, percent_space_required, current_space_dict
         )
 
         if rc != SnapshotStatus.SNAPSHOT_OK:
@@ -762,16 +997,17 @@ def extend_verify_snapshot_set(snapset_json):
     return SnapshotStatus.SNAPSHOT_OK, ""
 
 
-def snapshot_lv(vg_name, lv_name, suffix, snap_size, check_mode):
+def snapshot_lv(vg_name, lv_name, suffix, snap_size, check_mode, batch=None):
     snapshot_name = get_snapshot_name(lv_name, suffix)
 
-    rc, _vg_exists, lv_exists = lvm_lv_exists(vg_name, snapshot_name)
+    lv_exists, is_snapshot, _lv_attr, _lv_size = lvm_lookup(vg_name, snapshot_name)
+    origin_spec = vg_name + "/" + lv_name
 
     if lv_exists:
-        if lvm_is_snapshot(vg_name, snapshot_name):
+        if is_snapshot:
             return (
                 SnapshotStatus.ERROR_ALREADY_EXISTS,
-                "Snapshot of :" + vg_name + "/" + lv_name + " already exists",
+                "Snapshot of :" + origin_spec + " already exists",
             )
         else:
             return (
@@ -786,13 +1022,21 @@ def snapshot_lv(vg_name, lv_name, suffix, snap_size, check_mode):
         snapshot_name,
         "-L",
         str(snap_size) + "B",
-        vg_name + "/" + lv_name,
+        origin_spec,
     ]
 
     if check_mode:
-        return rc, "Would run command " + " ".join(snapshot_command)
+        return (
+            SnapshotStatus.SNAPSHOT_OK,
+            "Would run command " + " ".join(snapshot_command),
+        )
+
+    if batch is not None:
+        batch.append(snapshot_command)
+        return SnapshotStatus.SNAPSHOT_OK, ""
 
     rc, output = run_command(snapshot_command)
+    lvm_cache.invalidate()
 
     if rc:
         return SnapshotStatus.ERROR_SNAPSHOT_FAILED, output
@@ -829,10 +1073,7 @@ def check_space_for_snapshots(vg, lvs, lv_name, required_percent):
 
 
 def check_name_for_snapshot(lv_name, suffix):
-    if suffix:
-        suffix_len = len(suffix)
-    else:
-        suffix_len = 0
+    suffix_len = len(suffix or "")
 
     if len(lv_name) + suffix_len > MAX_LVM_NAME:
         return (
@@ -882,12 +1123,7 @@ def check_verify_lvs_set(snapset_json):
 
         snapshot_name = get_snapshot_name(lv, snapset_name)
 
-        rc, _vg_exists, lv_exists = lvm_lv_exists(vg, snapshot_name)
-        if rc != SnapshotStatus.SNAPSHOT_OK:
-            return (
-                SnapshotStatus.ERROR_VERIFY_COMMAND_FAILED,
-                "check verify: command failed for LV snapshot exists",
-            )
+        lv_exists = lvm_lv_present(vg, snapshot_name)
 
         if not lv_exists:
             return (
@@ -922,43 +1158,27 @@ def check_verify_lvs_completed(snapshot_all, vg_name, lv_name, suffix):
 
         for lvs in lv_list:
             lv_found = True
-            # Only verify that a snapshot exits for non-snapshot LVs
-            rc, is_snapshot = lvm_is_snapshot(verify_vg_name, lvs["lv_name"])
-            if rc != SnapshotStatus.SNAPSHOT_OK:
-                return (
-                    SnapshotStatus.ERROR_VERIFY_COMMAND_FAILED,
-                    "check verify: command failed for LV lvm_is_snapshot()",
-                )
-
-            if is_snapshot:
+            # Only verify that a snapshot exits for non-snapshot LVs, the
+            # iterator already returned the attributes of the source LV
+            if lvs["lv_attr"][0] == "s":
                 continue
 
             snapshot_name = get_snapshot_name(lvs["lv_name"], suffix)
 
-            rc, _vg_exists, lv_exists = lvm_lv_exists(verify_vg_name, snapshot_name)
-            if rc != SnapshotStatus.SNAPSHOT_OK:
+            # a single lookup tells whether the target exists and if it
+            # is a snapshot
+            snapshot_attr = lvm_get_attr(verify_vg_name, snapshot_name)
+
+            if snapshot_attr is None:
                 return (
-                    SnapshotStatus.ERROR_VERIFY_COMMAND_FAILED,
-                    "check verify: command failed for LV exists",
+                    SnapshotStatus.ERROR_VERIFY_NOTSNAPSHOT,
+                    "target logical volume snapshot does not exist",
                 )
 
-            if lv_exists:
-                rc, is_snapshot = lvm_is_snapshot(verify_vg_name, snapshot_name)
-                if rc != SnapshotStatus.SNAPSHOT_OK:
-                    return (
-                        SnapshotStatus.ERROR_VERIFY_COMMAND_FAILED,
-                        "check verify: command failed for LV lvm_is_snapshot()",
-                    )
-
-                if not is_snapshot:
-                    return (
-                        SnapshotStatus.ERROR_VERIFY_NOTSNAPSHOT,
-                        "target logical volume exits, but it is not a snapshot",
-                    )
-            else:
+            if snapshot_attr[0] != "s":
                 return (
                     SnapshotStatus.ERROR_VERIFY_NOTSNAPSHOT,
-                    "target logical volume snapshot does not exist",
+                    "target logical volume exits, but it is not a snapshot",
                 )
 
     if not snapshot_all:
@@ -976,31 +1196,63 @@ def check_verify_lvs_completed(snapshot_all, vg_name, lv_name, suffix):
     return SnapshotStatus.SNAPSHOT_OK, ""
 
 
-def revert_snapshot_set(snapset_json, check_mode):
+def revert_snapshot_set(snapset_json, check_mode, use_lvm_shell=False):
     snapset_name = snapset_json["name"]
     volume_list = snapset_json["volumes"]
     logger.info("revert snapsset : %s", snapset_name)
 
-    changed = False
-    for list_item in volume_list:
+    batch = [] if use_lvm_shell and len(volume_list) > 1 else None
+
+    def revert_volume(list_item):
         vg = list_item["vg"]
         lv = list_item["lv"]
 
-        rc, message = revert_lv(vg, get_snapshot_name(lv, snapset_name), check_mode)
+        rc, message = revert_lv(
+            vg, get_snapshot_name(lv, snapset_name), check_mode, batch
+        )
 
-        if rc != SnapshotStatus.SNAPSHOT_OK:
-            if rc == SnapshotStatus.ERROR_LV_NOTFOUND:
-                rc = SnapshotStatus.SNAPSHOT_OK  # already removed or reverted
-            return rc, message, changed
+        if rc in (SnapshotStatus.ERROR_LV_NOTFOUND, SnapshotStatus.ERROR_ALREADY_DONE):
+            # already removed or reverted, so don't let it hide a real
+            # failure on another volume of the set
+            return SnapshotStatus.SNAPSHOT_OK, "", False
 
         # if we got here at least 1 snapshot was reverted
-        changed = True
+        return rc, message, rc == SnapshotStatus.SNAPSHOT_OK
+
+    if batch is None:
+        return run_per_vg(volume_list, revert_volume)
+
+    return revert_snapshot_batch(volume_list, revert_volume, batch)
+
+
+def revert_snapshot_batch(volume_list, revert_volume, batch):
+    changed = False
+    for list_item in volume_list:
+        rc, message, cmd_changed = revert_volume(list_item)
+
+        if rc != SnapshotStatus.SNAPSHOT_OK:
+            # nothing queued has run yet, so the set is unchanged
+            return rc, message, False
+
+        if cmd_changed:
+            changed = True
+
+    if batch:
+        _shell_rc, output = run_lvm_shell(batch)
+        # the last argument of each command is the vg/snapshot merged
+        for command in batch:
+            vg_name, snapshot_name = command[-1].split("/")
+            lv_attr = lvm_get_attr(vg_name, snapshot_name)
+            # a merge on an open origin is deferred, leaving the snapshot
+            # in the merging state
+            if lv_attr is not None and lv_attr[0] != "S":
+                return SnapshotStatus.ERROR_REVERT_FAILED, output, changed
 
     return SnapshotStatus.SNAPSHOT_OK, "", changed
 
 
 def umount_verify(mountpoint, vg_name, lv_to_check):
-    blockdev = path_join(DEV_PREFIX, vg_name, lv_to_check)
+    blockdev = get_lv_dev_path(vg_name, lv_to_check)
 
     mount_list = lvm_get_fs_mount_points(mountpoint)
 
@@ -1033,6 +1285,8 @@ def umount_lv(umount_target, vg_name, lv_name, all_targets, check_mode):
 
     rc, message = umount(umount_target, all_targets, check_mode)
     changed = rc == SnapshotStatus.SNAPSHOT_OK
+    if changed:
+        mountinfo_cache.invalidate()
     if rc == SnapshotStatus.ERROR_UMOUNT_NOT_MOUNTED:
         rc = SnapshotStatus.SNAPSHOT_OK  # already unmounted - not an error
     return rc, message, changed
@@ -1134,7 +1388,7 @@ def mount_snapshot_set(
         else:
             lv_to_check = get_snapshot_name(lv_name, snapset_name)
 
-        blockdev = path_join(DEV_PREFIX, vg_name, lv_to_check)
+        blockdev = get_lv_dev_path(vg_name, lv_to_check)
 
         if verify_only:
             rc, message = mount_verify(
@@ -1196,7 +1450,7 @@ def mount_verify(origin, mountpoint, blockdev, vg_name, lv_name, snapset_name):
         if rc != SnapshotStatus.SNAPSHOT_OK:
             return rc, message
 
-        blockdev = path_join(DEV_PREFIX, vg_name, lv_to_check)
+        blockdev = get_lv_dev_path(vg_name, lv_to_check)
     else:
         mode = os.stat(blockdev).st_mode
         if not stat.S_ISBLK(mode):
@@ -1262,7 +1516,7 @@ def mount_lv(
         if rc != SnapshotStatus.SNAPSHOT_OK:
             return rc, message, changed
 
-        blockdev = path_join(DEV_PREFIX, vg_name, lv_to_mount)
+        blockdev = get_lv_dev_path(vg_name, lv_to_mount)
     else:
         mode = os.stat(blockdev).st_mode
         if not stat.S_ISBLK(mode):
@@ -1281,6 +1535,8 @@ def mount_lv(
 
     rc, message = mount(blockdev, mountpoint, fstype, options, create, check_mode)
     changed = rc == SnapshotStatus.SNAPSHOT_OK
+    if changed:
+        mountinfo_cache.invalidate()
     if rc == SnapshotStatus.ERROR_MOUNT_POINT_ALREADY_MOUNTED:
         rc = SnapshotStatus.SNAPSHOT_OK  # this is ok
 
@@ -1289,16 +1545,16 @@ def mount_lv(
 
 def remove_snapshot_set(snapset_json, check_mode):
     snapset_name = snapset_json["name"]
-    volume_list = snapset_json["volumes"]
+    snapshots = [
+        (item["vg"], get_snapshot_name(item["lv"], snapset_name))
+        for item in snapset_json["volumes"]
+    ]
     logger.info("remove snapsset : %s", snapset_name)
 
     # check to make sure the set is removable before attempting to remove
     changed = False
-    for list_item in volume_list:
-        vg = list_item["vg"]
-        lv = list_item["lv"]
-        snapshot_name = get_snapshot_name(lv, snapset_name)
-
+    to_remove = []
+    for vg, snapshot_name in snapshots:
         rc, vg_exists, lv_exists = lvm_lv_exists(vg, snapshot_name)
 
         if rc != SnapshotStatus.SNAPSHOT_OK:
@@ -1320,20 +1576,9 @@ def remove_snapshot_set(snapset_json, check_mode):
                 changed,
             )
 
-    for list_item in volume_list:
-        vg = list_item["vg"]
-        lv = list_item["lv"]
-
-        snapshot_name = get_snapshot_name(lv, snapset_name)
-
-        rc, vg_exists, lv_exists = lvm_lv_exists(vg, snapshot_name)
-        if rc != SnapshotStatus.SNAPSHOT_OK:
-            return rc, "failed to get LV status", changed
-
-        # if there is no snapshot, continue (idempotent)
-        if not vg_exists or not lv_exists:
-            continue
+        to_remove.append((vg, snapshot_name))
 
+    for vg, snapshot_name in to_remove:
         rc, message = lvm_snapshot_remove(vg, snapshot_name, check_mode)
 
         if rc != SnapshotStatus.SNAPSHOT_OK:
@@ -1347,22 +1592,15 @@ def remove_snapshot_set(snapset_json, check_mode):
 
 def remove_verify_snapshot_set(snapset_json):
     snapset_name = snapset_json["name"]
-    volume_list = snapset_json["volumes"]
+    snapshots = [
+        (item["vg"], get_snapshot_name(item["lv"], snapset_name))
+        for item in snapset_json["volumes"]
+    ]
 
     logger.info("remove verify snapsset : %s", snapset_name)
 
-    for list_item in volume_list:
-        vg = list_item["vg"]
-        lv = list_item["lv"]
-
-        snapshot_name = get_snapshot_name(lv, snapset_name)
-
-        rc, _vg_exists, lv_exists = lvm_lv_exists(vg, snapshot_name)
-        if rc != SnapshotStatus.SNAPSHOT_OK:
-            return (
-                rc,
-                "volume exists that matches the pattern: " + vg + "/" + snapshot_name,
-            )
+    for vg, snapshot_name in snapshots:
+        lv_exists = lvm_lv_present(vg, snapshot_name)
 
         if lv_exists:
             return (
@@ -1392,26 +1630,13 @@ def remove_verify_snapshots(vg_name, lv_name, suffix):
         verify_vg_name = vg["vg_name"]
 
         for lvs in lv_list:
-            rc, is_snapshot = lvm_is_snapshot(verify_vg_name, lvs["lv_name"])
-            if rc != SnapshotStatus.SNAPSHOT_OK:
-                return (
-                    SnapshotStatus.ERROR_VERIFY_REMOVE_FAILED,
-                    "command failed for LV lvm_is_snapshot() failed to get status",
-                )
-
             # Only verify for non-snapshot LVs
-            if is_snapshot:
+            if lvs["lv_attr"][0] == "s":
                 continue
 
             snapshot_name = get_snapshot_name(lvs["lv_name"], suffix)
 
-            rc, _vg_exists, lv_exists = lvm_lv_exists(verify_vg_name, snapshot_name)
-
-            if rc != SnapshotStatus.SNAPSHOT_OK:
-                return (
-                    SnapshotStatus.ERROR_VERIFY_COMMAND_FAILED,
-                    "remove verify: command failed for LV exists",
-                )
+            lv_exists = lvm_lv_present(verify_vg_name, snapshot_name)
 
             if lv_exists:
                 return (
@@ -1425,9 +1650,11 @@ def remove_verify_snapshots(vg_name, lv_name, suffix):
     return SnapshotStatus.SNAPSHOT_OK, ""
 
 
-def get_current_space_state():
+def get_current_space_state(vg_names=None):
+    """Return the space state of the VGs named in vg_names, or of all VGs
+    if vg_names is None."""
     vg_size_dict = dict()
-    for volume_group, lv_list in vgs_lvs_iterator(None, None):
+    for volume_group, lv_list in vgs_lvs_iterator(None, None, vg_names=vg_names):
         vg_name = volume_group["vg_name"]
         vg_space = VGSpaceState()
 
@@ -1435,32 +1662,27 @@ def get_current_space_state():
         vg_space.vg_free = int(volume_group["vg_free"])
         vg_space.vg_size = int(volume_group["vg_size"])
         vg_space.vg_extent_size = int(volume_group["vg_extent_size"])
-        logger.info(
-            "get_current_space_state: %s \n \
-                \tvg_size : %d \n \
-                \tvg_free : %d  \
-                \tvg_extent_size : %d ",
-            vg_name,
-            vg_space.vg_size,
-            vg_space.vg_free,
-            vg_space.vg_extent_size,
-        )
 
         for lv in lv_list:
-            lv_name = lv["lv_name"]
             lv_space = LVSpaceState()
 
-            vg_space.lvs[lv_name] = lv_space
+            vg_space.lvs[lv["lv_name"]] = lv_space
             lv_space.lv_size = int(lv["lv_size"])
             # TODO get chunk size in case it isn't default?
-            logger.info(
-                "\t\tlv: %s \n \
-                \t\tlv_size : %s \n \
-                \t\tchunk_size : %s \n ",
-                lv_name,
-                lv_space.lv_size,
-                lv_space.chunk_size,
-            )
+
+        logger.debug(
+            "get_current_space_state: %s vg_size : %d vg_free : %d "
+            "vg_extent_size : %d%s",
+            vg_name,
+            vg_space.vg_size,
+            vg_space.vg_free,
+            vg_space.vg_extent_size,
+            "".join(
+                "\n\tlv: %s lv_size : %d chunk_size : %d"
+                % (lv_name, lv_space.lv_size, lv_space.chunk_size)
+                for lv_name, lv_space in vg_space.lvs.items()
+            ),
+        )
 
     return SnapshotStatus.SNAPSHOT_OK, "", vg_size_dict
 
@@ -1491,37 +1713,28 @@ def verify_source_lvs_exist(vg_name, lv_name):
 
 def verify_snapset_target_no_existing(snapset_json):
     snapset_name = snapset_json["name"]
-    volume_list = snapset_json["volumes"]
+    snapshots = [
+        (item["vg"], get_snapshot_name(item["lv"], snapset_name))
+        for item in snapset_json["volumes"]
+    ]
     logger.info("verify snapsset : %s", snapset_name)
 
-    for list_item in volume_list:
-        vg = list_item["vg"]
-        lv = list_item["lv"]
+    for vg, snapshot_name in snapshots:
+        lv_exists, is_snapshot, _lv_attr, _lv_size = lvm_lookup(vg, snapshot_name)
 
-        snapshot_name = get_snapshot_name(lv, snapset_name)
+        if not lv_exists:
+            continue
 
-        rc, _vg_exists, lv_exists = lvm_lv_exists(vg, snapshot_name)
-        if rc != SnapshotStatus.SNAPSHOT_OK:
+        if is_snapshot:
             return (
-                rc,
-                "could not determine if snapshot exists: " + vg + "/" + snapshot_name,
+                SnapshotStatus.ERROR_ALREADY_EXISTS,
+                "snapshot already exists: " + vg + "/" + snapshot_name,
             )
 
-        if lv_exists:
-            rc, exists = lvm_is_snapshot(vg, snapshot_name)
-            if rc == SnapshotStatus.SNAPSHOT_OK and exists:
-                return (
-                    SnapshotStatus.ERROR_ALREADY_EXISTS,
-                    "snapshot already exists: " + vg + "/" + snapshot_name,
-                )
-            else:
-                return (
-                    SnapshotStatus.ERROR_SNAPSET_CHECK_STATUS_FAILED,
-                    "volume exists that matches the pattern: "
-                    + vg
-                    + "/"
-                    + snapshot_name,
-                )
+        return (
+            SnapshotStatus.ERROR_SNAPSET_CHECK_STATUS_FAILED,
+            "volume exists that matches the pattern: " + vg + "/" + snapshot_name,
+        )
 
     return SnapshotStatus.SNAPSHOT_OK, ""
 
@@ -1581,14 +1794,17 @@ def get_space_needed(vg, lv, percent_space_required, current_space_dict):
 
 # precheck the set to make sure there is sufficient space for the snapshots
 def snapshot_precheck_lv_set_space(snapset_json):
-    total_space_requested = dict()
+    total_space_requested = defaultdict(int)
     volume_list = snapset_json["volumes"]
 
-    # Calculate total space needed for each VG
-    rc, _message, current_space_dict = get_current_space_state()
+    rc, _message, current_space_dict = get_current_space_state(
+        set(list_item["vg"] for list_item in volume_list)
+    )
     if rc != SnapshotStatus.SNAPSHOT_OK:
         return rc, "get_space_state failure in snapshot_precheck_lv_set_space", None
 
+    # Add up the space needed for each VG, and stop as soon as one of the
+    # totals is more than the free space in its VG
     for list_item in volume_list:
         vg = list_item["vg"]
         lv = list_item["lv"]
@@ -1598,14 +1814,7 @@ def snapshot_precheck_lv_set_space(snapset_json):
         required_size = get_space_needed(
             vg, lv, percent_space_required, current_space_dict
         )
-        if vg in total_space_requested:
-            total_space_requested[vg] += required_size
-        else:
-            total_space_requested[vg] = required_size
-
-    # Check to make sure there is enough total space
-    for list_item in volume_list:
-        vg = list_item["vg"]
+        total_space_requested[vg] += required_size
 
         if total_space_requested[vg] > current_space_dict[vg].vg_free:
             return (
@@ -1627,23 +1836,11 @@ def snapshot_precheck_lv_set(snapset_json):
     if rc != SnapshotStatus.SNAPSHOT_OK:
         return rc, message, None
 
-    snapset_name = snapset_json["name"]
-    volume_list = snapset_json["volumes"]
-    logger.info("verify snapsset : %s", snapset_name)
-
     # Verify the names for the snapshots are ok
     rc, message = verify_snapset_names(snapset_json)
     if rc != SnapshotStatus.SNAPSHOT_OK:
         return rc, message, None
 
-    # check to make sure there are no naming conflicts
-    for list_item in volume_list:
-        lv = list_item["lv"]
-
-        rc, message = check_name_for_snapshot(lv, snapset_name)
-        if rc != SnapshotStatus.SNAPSHOT_OK:
-            return rc, "resulting snapshot name would exceed LVM maximum", None
-
     rc, message, current_space_dict = snapshot_precheck_lv_set_space(snapset_json)
     if rc != SnapshotStatus.SNAPSHOT_OK:
         return rc, message, None
@@ -1651,10 +1848,11 @@ def snapshot_precheck_lv_set(snapset_json):
     return SnapshotStatus.SNAPSHOT_OK, "", current_space_dict
 
 
-def snapshot_create_set(snapset_json, check_mode):
+def snapshot_create_set(snapset_json, check_mode, use_lvm_shell=False):
     snapset_name = snapset_json["name"]
     volume_list = snapset_json["volumes"]
     changed = False
+    batch = [] if use_lvm_shell and len(volume_list) > 1 else None
 
     rc, message, current_space_dict = snapshot_precheck_lv_set(snapset_json)
     if rc != SnapshotStatus.SNAPSHOT_OK:
@@ -1673,23 +1871,33 @@ def snapshot_create_set(snapset_json, check_mode):
             vg, lv, percent_space_required, current_space_dict
         )
 
-        rc, message = snapshot_lv(vg, lv, snapset_name, required_size, check_mode)
+        rc, message = snapshot_lv(
+            vg, lv, snapset_name, required_size, check_mode, batch
+        )
         if rc != SnapshotStatus.SNAPSHOT_OK:
+            if batch is not None:
+                changed = False  # nothing queued has run yet
             return rc, message, changed
 
         # if we got here, at least 1 snapshot was created
         changed = True
 
-    return SnapshotStatus.SNAPSHOT_OK, "", changed
+    if batch:
+        _rc, output = run_lvm_shell(batch)
+        rc, message = check_verify_lvs_set(snapset_json)
+        if rc != SnapshotStatus.SNAPSHOT_OK:
+            return (
+                SnapshotStatus.ERROR_SNAPSHOT_FAILED,
+                message + ": " + output,
+                changed,
+            )
 
+    return SnapshotStatus.SNAPSHOT_OK, "", changed
 
-def snapshot_set(snapset_json, check_mode):
-    changed = False
-    rc, message = verify_snapset_source_lvs_exist(snapset_json)
-    if rc != SnapshotStatus.SNAPSHOT_OK:
-        return rc, message, changed
 
-    rc, message, changed = snapshot_create_set(snapset_json, check_mode)
+def snapshot_set(snapset_json, check_mode, use_lvm_shell=False):
+    # snapshot_create_set prechecks that the source lvs exist
+    rc, message, changed = snapshot_create_set(snapset_json, check_mode, use_lvm_shell)
 
     return rc, message, changed
 
@@ -1822,7 +2030,7 @@ def validate_snapset_args(args):
 
 def print_result(result):
     json.dump(result, sys.stdout, indent=4)
-    logger.info("exit code: %d: %s", result["return_code"], str(result["errors"]))
+    logger.info("exit code: %d: %s", result["return_code"], result["errors"])
 
 
 def validate_json_request(snapset_json, check_percent_space_required):
@@ -1998,33 +2206,38 @@ def get_json_from_args(args):
         if rc != SnapshotStatus.SNAPSHOT_OK:
             return rc, message, ""
 
-    if args.suffix:
-        args_json["name"] = args.suffix
+    suffix = args.suffix
+    if suffix:
+        args_json["name"] = suffix
+
+    has_required_space = hasattr(args, "required_space")
 
     for vg, lv_list in vgs_lvs_iterator(args.volume_group, args.logical_volume):
         vg_str = vg["vg_name"]
         for lv in lv_list:
+            lv_name = lv["lv_name"]
 
-            if lv["lv_name"].endswith(args.suffix):
+            if lv_name.endswith(suffix):
                 continue
 
-            volume = {}
-            volume["name"] = ("snapshot : " + vg_str + "/" + lv["lv_name"],)
-            volume["vg"] = vg_str
-            volume["lv"] = lv["lv_name"]
-            if hasattr(args, "required_space"):
+            volume = {
+                "name": "snapshot : " + vg_str + "/" + lv_name,
+                "vg": vg_str,
+                "lv": lv_name,
+            }
+            if has_required_space:
                 volume["percent_space_required"] = args.required_space
 
             if cmd == SnapshotCommand.MOUNT:
-                volume["mountpoint_create"] = args.create
-                volume["mountpoint"] = args.mountpoint
-                volume["mount_origin"] = args.origin
-                volume["fstype"] = args.fstype
-                volume["options"] = args.options
-
-            if cmd == SnapshotCommand.UMOUNT:
-                volume["mountpoint"] = args.mountpoint
-                volume["all_targets"] = args.all_targets
+                volume.update(
+                    mountpoint_create=args.create,
+                    mountpoint=args.mountpoint,
+                    mount_origin=args.origin,
+                    fstype=args.fstype,
+                    options=args.options,
+                )
+            elif cmd == SnapshotCommand.UMOUNT:
+                volume.update(mountpoint=args.mountpoint, all_targets=args.all_targets)
 
             volume_list.append(volume)
 
@@ -2045,7 +2258,9 @@ def snapshot_cmd(args, snapset_dict):
         args.check_mode,
     )
 
-    rc, message, changed = snapshot_set(snapset_dict, args.check_mode)
+    rc, message, changed = snapshot_set(
+        snapset_dict, args.check_mode, args.use_lvm_shell
+    )
 
     return {"return_code": rc, "errors": [message], "changed": changed}
 
@@ -2107,7 +2322,9 @@ def revert_cmd(args, snapset_dict):
         # cause the snapshot to no longer exist
         rc, message = remove_verify_snapshot_set(snapset_dict)
     else:
-        rc, message, changed = revert_snapshot_set(snapset_dict, args.check_mode)
+        rc, message, changed = revert_snapshot_set(
+            snapset_dict, args.check_mode, args.use_lvm_shell
+        )
 
     return {"return_code": rc, "errors": [message], "changed": changed}
 
@@ -2127,7 +2344,9 @@ def extend_cmd(args, snapset_dict):
     if args.verify:
         rc, message = extend_verify_snapshot_set(snapset_dict)
     else:
-        rc, message, changed = extend_snapshot_set(snapset_dict, args.check_mode)
+        rc, message, changed = extend_snapshot_set(
+            snapset_dict, args.check_mode, args.use_lvm_shell
+        )
 
     return {"return_code": rc, "errors": [message], "changed": changed}
 
@@ -2236,6 +2455,13 @@ if __name__ == "__main__":
         dest="check_mode",
         help="Are we running in Ansible check-mode?",
     )
+    common_parser.add_argument(
+        "--lvm-shell",
+        action="store_true",
+        default=False,
+        dest="use_lvm_shell",
+        help="run the lvm commands for a set of volumes in a single lvm shell",
+    )
 
     # Group parser
     group_parser = argparse.ArgumentParser(add_help=False)